@@ -7,6 +7,19 @@ import streamlit as st
 import sqlite3
 from datetime import datetime, date
 import pandas as pd
+import numpy as np
+import calendar
+import altair as alt
+from datetime import timedelta
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import os
+import re
+import glob
+from db import (DB_PATH, init_db, seed_data, save_attendance, save_roster, get_data_version, get_time_slots, render_digest,
+                database_size, maintenance_due, run_maintenance)
 
 # Page config
 st.set_page_config(
@@ -62,114 +75,118 @@ if not st.session_state.logged_in and "coach_id" in query_params:
     except:
         pass
 
-# Database path - works locally and on Render
-import os
-DB_PATH = os.environ.get('DATABASE_PATH', 'believers_academy.db')
+# Background job artifacts (Excel exports) - only the newest EXPORT_KEEP files are kept;
+# finished jobs drop out of the jobs table after JOB_HISTORY_DAYS
+EXPORT_DIR = os.environ.get('EXPORT_DIR', 'exports')
+EXPORT_KEEP = 20
+JOB_HISTORY_DAYS = 30
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
+class QueryCache:
+    """Report query results keyed by (sql, params), valid only for the data version they were read at"""
     
-    # Centres table
-    c.execute('''CREATE TABLE IF NOT EXISTS centres (
-        id INTEGER PRIMARY KEY,
-        name TEXT UNIQUE NOT NULL,
-        address TEXT,
-        monday_friday_slots TEXT,
-        saturday_sunday_slots TEXT,
-        is_active INTEGER DEFAULT 1
-    )''')
-    
-    # Coaches table
-    c.execute('''CREATE TABLE IF NOT EXISTS coaches (
-        id INTEGER PRIMARY KEY,
-        name TEXT UNIQUE NOT NULL,
-        pin TEXT NOT NULL,
-        role TEXT DEFAULT 'coach',
-        assigned_centre_id INTEGER,
-        FOREIGN KEY (assigned_centre_id) REFERENCES centres(id)
-    )''')
-    
-    # Students table
-    c.execute('''CREATE TABLE IF NOT EXISTS students (
-        id INTEGER PRIMARY KEY,
-        name TEXT NOT NULL,
-        centre_id INTEGER,
-        phone TEXT,
-        parent_phone TEXT,
-        join_date TEXT,
-        is_active INTEGER DEFAULT 1,
-        FOREIGN KEY (centre_id) REFERENCES centres(id)
-    )''')
-    
-    # Attendance table
-    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
-        id INTEGER PRIMARY KEY,
-        date TEXT NOT NULL,
-        coach_id INTEGER,
-        student_id INTEGER,
-        centre_id INTEGER,
-        time_slot TEXT NOT NULL,
-        status TEXT DEFAULT 'Present',
-        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (coach_id) REFERENCES coaches(id),
-        FOREIGN KEY (student_id) REFERENCES students(id),
-        FOREIGN KEY (centre_id) REFERENCES centres(id)
-    )''')
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
     
-    conn.commit()
-    return conn
+    def fetchall(self, c, sql, params=()):
+        version = get_data_version(c)
+        key = (sql, tuple(params))
+        
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        
+        c.execute(sql, params)
+        rows = c.fetchall()
+        
+        with self.lock:
+            if version == self.version:
+                self.entries[key] = rows
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return rows
+    
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "version": self.version}
+
+@st.cache_resource
+def get_query_cache():
+    """One cache shared by all sessions for the life of the server process"""
+    return QueryCache()
 
-def seed_data(conn):
-    """Seed initial data if tables are empty"""
+@st.cache_data(max_entries=64, show_spinner=False)
+def attendance_matrix(centre_id, month, data_version):
+    """Student x date register (P/A/L) for one centre and YYYY-MM month.
+    data_version is only part of the cache key, so edits invalidate old results."""
     c = conn.cursor()
+    year, month_num = int(month[:4]), int(month[5:])
+    days = calendar.monthrange(year, month_num)[1]
     
-    # Check if centres exist
-    c.execute("SELECT COUNT(*) FROM centres")
-    if c.fetchone()[0] == 0:
-        # Seed centres
-        centres = [
-            ("Dadar Railways", "Dadar Railway Station, Dadar East", "4 PM - 5 PM, 5 PM - 6 PM, 6 PM - 7 PM, 7 PM - 8 PM", "11 AM - 12 PM, 12 PM - 1 PM, 1 PM - 2 PM, 2 PM - 3 PM", 1),
-            ("Parsee Gymkhana", "Dadar West", "6 AM - 7 AM, 7 AM - 8 AM, 8 AM - 9 AM", "6 AM - 7 AM, 7 AM - 8 AM, 8 AM - 9 AM", 1),
-            ("Nirmal Park", "Nirmal Nagar, Byculla", "", "", 0),  # Dormant
-            ("Badhwar Park", "Colaba", "5 PM - 6 PM, 6 PM - 7 PM", "5 PM - 6 PM, 6 PM - 7 PM", 1),
-        ]
-        c.executemany("INSERT INTO centres (name, address, monday_friday_slots, saturday_sunday_slots, is_active) VALUES (?, ?, ?, ?, ?)", centres)
-        
-    # Check if coaches exist
-    c.execute("SELECT COUNT(*) FROM coaches")
-    if c.fetchone()[0] == 0:
-        # Seed coaches (PIN: 4 digits)
-        coaches = [
-            ("Prathamesh", "1234", "admin", None),  # Admin
-            ("Gautam", "5678", "coach", 2),          # Parsee Gymkhana
-            ("Madhur", "9012", "coach", 1),          # Dadar Railways
-            ("Sanket", "3456", "coach", 3),          # Nirmal Park (dormant)
-            ("Arif", "7890", "partner", None),       # Can see all
-            ("Manas", "2345", "partner", None),      # Can see all
-            ("Darshak", "6789", "partner", None),   # Can see all
-        ]
-        c.executemany("INSERT INTO coaches (name, pin, role, assigned_centre_id) VALUES (?, ?, ?, ?)", coaches)
-    
-    # Check if students exist
-    c.execute("SELECT COUNT(*) FROM students")
-    if c.fetchone()[0] == 0:
-        # Seed sample students (no parent phone - just name and mobile)
-        students = [
-            ("Aarav Sharma", 1, "9876543210", "2026-01-01"),
-            ("Vihaan Patel", 1, "9876543212", "2026-01-01"),
-            ("Arnav Singh", 1, "9876543214", "2026-01-05"),
-            ("Sai Kulkarni", 2, "9876543216", "2026-01-02"),
-            ("Reyansh Joshi", 2, "9876543218", "2026-01-03"),
-            ("Ayaan Desai", 2, "9876543220", "2026-01-04"),
-            ("Krishna Gawde", 4, "9876543222", "2026-01-06"),
-            ("OM Shinde", 4, "9876543224", "2026-01-07"),
-            ("Pranav Nair", 1, "9876543226", "2026-01-08"),
-            ("Kartik Iyer", 2, "9876543228", "2026-01-09"),
-        ]
-        c.executemany("INSERT INTO students (name, centre_id, phone, join_date) VALUES (?, ?, ?, ?)", students)
+    # One row per student per day; multiple slots collapse to the best status (P > L > A)
+    c.execute("""
+        SELECT a.student_id, s.name, CAST(substr(a.date, 9, 2) AS INTEGER),
+               MIN(CASE a.status WHEN 'Present' THEN 0 WHEN 'Leave' THEN 1 ELSE 2 END)
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        WHERE a.centre_id = ? AND a.date BETWEEN ? AND ?
+        GROUP BY a.student_id, a.date
+    """, (centre_id, f"{month}-01", f"{month}-{days:02d}"))
+    rows = c.fetchall()
     
-    conn.commit()
+    if not rows:
+        return pd.DataFrame()
+    
+    df = pd.DataFrame(rows, columns=["ID", "Student", "Day", "Code"])
+    names = df.drop_duplicates("ID").set_index("ID")["Student"]
+    pivot = df.pivot(index="ID", columns="Day", values="Code").reindex(columns=range(1, days + 1))
+    codes = pivot.to_numpy()
+    
+    # Map codes to letters in one shot; NaN = no record that day
+    labels = np.array(["P", "L", "A"], dtype=object)
+    cells = np.where(np.isnan(codes), "", labels[np.nan_to_num(codes).astype(int)])
+    
+    matrix = pd.DataFrame(cells, index=names.loc[pivot.index].values, columns=[f"{d:02d}" for d in range(1, days + 1)])
+    matrix["P"] = (cells == "P").sum(axis=1)
+    matrix["A"] = (cells == "A").sum(axis=1)
+    matrix["L"] = (cells == "L").sum(axis=1)
+    matrix.index.name = "Student"
+    return matrix.sort_index()
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def whatsapp_digest(date_str, data_version):
+    """All centres' present lists for one date (data_version only keys the cache)"""
+    return render_digest(conn.cursor(), date_str)
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def slot_occupancy(start_date, end_date, data_version):
+    """Present headcount per (centre, date, slot) for active centres, from one grouped query.
+    Heatmap and trend lines are both derived from this frame."""
+    c = conn.cursor()
+    c.execute("""
+        SELECT c.name, a.date, CAST(strftime('%w', a.date) AS INTEGER), a.time_slot, SUM(a.status = 'Present')
+        FROM attendance a
+        JOIN centres c ON a.centre_id = c.id
+        WHERE c.is_active = 1 AND a.date BETWEEN ? AND ?
+        GROUP BY a.centre_id, a.date, a.time_slot
+    """, (start_date.isoformat(), end_date.isoformat()))
+    
+    df = pd.DataFrame(c.fetchall(), columns=["Centre", "Date", "Weekday", "Time Slot", "Headcount"])
+    # strftime('%w') is 0=Sunday; show Monday first
+    weekdays = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+    df["Weekday"] = pd.Categorical(df["Weekday"].map(lambda d: weekdays[d]), categories=weekdays[1:] + weekdays[:1], ordered=True)
+    df["Date"] = pd.to_datetime(df["Date"])
+    return df
 
 # Initialize
 conn = init_db()
@@ -259,23 +276,6 @@ def login():
             else:
                 st.error("Invalid PIN. Please try again.")
 
-def get_time_slots(centre_id, selected_date):
-    """Get time slots based on centre and day of week"""
-    c = conn.cursor()
-    c.execute("SELECT monday_friday_slots, saturday_sunday_slots FROM centres WHERE id = ?", (centre_id,))
-    row = c.fetchone()
-    
-    if not row:
-        return []
-    
-    day = selected_date.weekday()  # 0=Monday, 6=Sunday
-    slots_str = row[1] if day >= 5 else row[0]  # Sat/Sun or Mon-Fri
-    
-    if not slots_str:
-        return []
-    
-    return [s.strip() for s in slots_str.split(",")]
-
 def mark_attendance_page():
     try:
         st.image("logo.jpg", width=100)
@@ -361,7 +361,7 @@ def mark_attendance_page():
     date_key = selected_date.isoformat()
     
     # Get time slots
-    time_slots = get_time_slots(selected_centre_id, selected_date)
+    time_slots = get_time_slots(c, selected_centre_id, selected_date)
     
     if not time_slots:
         st.warning("No time slots configured for this centre on this day.")
@@ -381,6 +381,18 @@ def mark_attendance_page():
     all_students = c.fetchall()
     student_options = {s[1]: s[0] for s in all_students}
     
+    # Regulars for every slot of this weekday, so each slot can be prefilled in one go
+    c.execute("""
+        SELECT r.time_slot, s.id, s.name
+        FROM expected_roster r
+        JOIN students s ON r.student_id = s.id
+        WHERE r.centre_id = ? AND r.weekday = ? AND s.is_active = 1
+        ORDER BY s.name
+    """, (selected_centre_id, selected_date.weekday()))
+    regulars = {}
+    for slot, student_id, name in c.fetchall():
+        regulars.setdefault(slot, []).append((student_id, name))
+    
     st.markdown(f"### 🏸 Mark Attendance - {centre_names[selected_centre_id]}")
     st.markdown(f"**Date:** {selected_date.strftime('%d/%m/%Y')} ({selected_date.strftime('%A')})")
     
@@ -410,6 +422,19 @@ def mark_attendance_page():
                 # Students in this slot
                 students_list = slot_data.get("students", [])
                 
+                # Load the usual crowd in one go - coach then only marks exceptions
+                slot_regulars = regulars.get(selected_slot, [])
+                if slot_regulars:
+                    if st.button(f"⭐ Prefill regulars ({len(slot_regulars)})", key=f"prefill_{slot_key}"):
+                        added_ids = {s["student_id"] for s in students_list}
+                        students_list.extend(
+                            {"student_id": student_id, "name": name, "status": "Present"}
+                            for student_id, name in slot_regulars
+                            if student_id not in added_ids
+                        )
+                        st.session_state.all_slot_attendance[slot_key]["students"] = students_list
+                        st.rerun()
+                
                 # Search and add student
                 col1, col2 = st.columns([3, 1])
                 with col1:
@@ -481,6 +506,7 @@ def mark_attendance_page():
         if st.button("💾 SAVE ATTENDANCE", type="primary", use_container_width=True):
             date_str = selected_date.isoformat()
             
+            rows = []
             for selected_slot in time_slots:
                 slot_key = f"{date_key}_{selected_centre_id}_{selected_slot}"
                 slot_data = st.session_state.all_slot_attendance.get(slot_key, {"students": [], "no_students": False})
@@ -488,56 +514,14 @@ def mark_attendance_page():
                 if slot_data.get("no_students", False):
                     continue
                 
-                students_list = slot_data.get("students", [])
-                for student in students_list:
-                    student_id = student["student_id"]
-                    status = student["status"]
-                    
-                    # Check if entry exists
-                    c.execute("""
-                        SELECT id FROM attendance 
-                        WHERE student_id = ? AND centre_id = ? AND date = ? AND time_slot = ?
-                    """, (student_id, selected_centre_id, date_str, selected_slot))
-                    existing_entry = c.fetchone()
-                    
-                    if existing_entry:
-                        c.execute("""
-                            UPDATE attendance SET status = ?, coach_id = ? 
-                            WHERE student_id = ? AND centre_id = ? AND date = ? AND time_slot = ?
-                        """, (status, coach["id"], student_id, selected_centre_id, date_str, selected_slot))
-                    else:
-                        c.execute("""
-                            INSERT INTO attendance (student_id, centre_id, date, time_slot, status, coach_id)
-                            VALUES (?, ?, ?, ?, ?, ?)
-                        """, (student_id, selected_centre_id, date_str, selected_slot, status, coach["id"]))
+                for student in slot_data.get("students", []):
+                    rows.append((student["student_id"], selected_centre_id, date_str, selected_slot, student["status"], coach["id"]))
             
+            save_attendance(c, rows)
             conn.commit()
             
             # Generate WhatsApp message
-            day_name = selected_date.strftime("%A")
-            date_display = selected_date.strftime("%d/%m/%Y")
-            centre_name = centre_names[selected_centre_id]
-            
-            # Group students by time slot
-            wa_message = f"*{date_display}*\n*{centre_name}*\n*{day_name}*\n\n"
-            
-            for slot in time_slots:
-                slot_key = f"{date_key}_{selected_centre_id}_{slot}"
-                slot_data = st.session_state.all_slot_attendance.get(slot_key, {"students": [], "no_students": False})
-                
-                if slot_data.get("no_students", False):
-                    continue
-                
-                students_list = slot_data.get("students", [])
-                present_students = [s for s in students_list if s["status"] == "Present"]
-                
-                if present_students:
-                    wa_message += f"*{slot}*\n"
-                    for idx, s in enumerate(present_students, 1):
-                        wa_message += f"{idx}. {s['name']}\n"
-                    wa_message += "\n"
-            
-            st.session_state.last_wa_message = wa_message
+            st.session_state.last_wa_message = render_digest(c, date_str, [selected_centre_id])
             st.session_state.attendance_saved = True
             st.rerun()
     else:
@@ -548,6 +532,176 @@ def mark_attendance_page():
         st.session_state.all_slot_attendance = {}
         st.rerun()
 
+@st.cache_resource
+def get_job_executor():
+    """Thread pool for background jobs - one per server process"""
+    # Jobs queued or running in a previous process will never finish
+    job_conn = sqlite3.connect(DB_PATH)
+    job_conn.execute("""
+        UPDATE jobs SET status = 'failed', message = 'Interrupted by server restart', finished_at = CURRENT_TIMESTAMP
+        WHERE status IN ('queued', 'running')
+    """)
+    job_conn.commit()
+    job_conn.close()
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="job")
+
+def submit_job(kind, description, func, *args):
+    """Queue func(job_conn, report_progress, *args) on the job pool; returns the job id.
+    func returns (result_path, message) and must not touch st.*"""
+    executor = get_job_executor()
+    c = conn.cursor()
+    c.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < datetime('now', ?)",
+              (f"-{JOB_HISTORY_DAYS} days",))
+    c.execute("INSERT INTO jobs (kind, description, created_by) VALUES (?, ?, ?)",
+              (kind, description, st.session_state.coach["id"]))
+    job_id = c.lastrowid
+    conn.commit()
+    executor.submit(run_job, job_id, func, *args)
+    return job_id
+
+def run_job(job_id, func, *args):
+    """Worker thread body - uses its own connection and records status in the jobs table"""
+    job_conn = sqlite3.connect(DB_PATH, timeout=30)
+    
+    def report_progress(fraction):
+        # Commits pending work too, so progress is visible to other connections
+        job_conn.execute("UPDATE jobs SET progress = ? WHERE id = ?", (min(fraction, 1.0), job_id))
+        job_conn.commit()
+    
+    try:
+        job_conn.execute("UPDATE jobs SET status = 'running' WHERE id = ?", (job_id,))
+        job_conn.commit()
+        result_path, message = func(job_conn, report_progress, *args)
+        job_conn.execute("""
+            UPDATE jobs SET status = 'done', progress = 1, result_path = ?, message = ?, finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        """, (result_path, message, job_id))
+        job_conn.commit()
+    except Exception as e:
+        job_conn.rollback()
+        job_conn.execute("UPDATE jobs SET status = 'failed', message = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                         (str(e), job_id))
+        job_conn.commit()
+    finally:
+        job_conn.close()
+
+def import_students_job(job_conn, report_progress, df_upload, centre_id):
+    """Import name, mobile rows in chunks; each chunk is committed with its progress.
+    Students are matched by name within the centre (save_roster), so re-running a failed import is safe"""
+    names = df_upload.iloc[:, 0].astype(str).str.strip()
+    # Blank phone cells must stay blank - save_roster keeps the stored phone for those
+    phones = df_upload.iloc[:, 1].fillna("").astype(str).str.strip() if df_upload.shape[1] > 1 else [""] * len(df_upload)
+    join_date = date.today().isoformat()
+    rows = [(name, centre_id, phone, join_date) for name, phone in zip(names, phones) if name and name != "nan"]
+    
+    c = job_conn.cursor()
+    inserted = updated = 0
+    chunk_size = 500
+    for start in range(0, len(rows), chunk_size):
+        try:
+            chunk_inserted, chunk_updated = save_roster(c, rows[start:start + chunk_size])
+        except Exception as e:
+            raise RuntimeError(f"{e} - {inserted} added, {updated} updated before the error; re-run the import to finish") from e
+        inserted += chunk_inserted
+        updated += chunk_updated
+        report_progress((start + chunk_size) / len(rows))
+    
+    return None, f"{inserted} students added, {updated} phones updated"
+
+def export_attendance_job(job_conn, report_progress, start_date, end_date):
+    """Excel workbook with one sheet per centre for the date range"""
+    centres = job_conn.execute("SELECT id, name FROM centres ORDER BY name").fetchall()
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"attendance_{start_date}_{end_date}_{datetime.now():%Y%m%d%H%M%S}.xlsx")
+    
+    total = 0
+    used_sheet_names = set()
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for i, (centre_id, centre_name) in enumerate(centres):
+            # Excel sheet names: max 31 chars, none of []:*?/\, unique ignoring case
+            sheet_name = re.sub(r"[\[\]:*?/\\]", "", centre_name).strip("' ")[:31] or f"Centre {centre_id}"
+            if sheet_name.lower() in used_sheet_names:
+                suffix = f" ({centre_id})"
+                sheet_name = sheet_name[:31 - len(suffix)] + suffix
+            used_sheet_names.add(sheet_name.lower())
+            
+            df = pd.read_sql_query("""
+                SELECT a.date AS Date, s.name AS Student, a.time_slot AS "Time Slot", a.status AS Status, co.name AS Coach
+                FROM attendance a
+                JOIN students s ON a.student_id = s.id
+                LEFT JOIN coaches co ON a.coach_id = co.id
+                WHERE a.centre_id = ? AND a.date BETWEEN ? AND ?
+                ORDER BY a.date, a.time_slot, s.name
+            """, job_conn, params=(centre_id, start_date, end_date))
+            df.to_excel(writer, sheet_name=sheet_name, index=False)
+            total += len(df)
+            report_progress((i + 1) / len(centres))
+    
+    exports = sorted(glob.glob(os.path.join(EXPORT_DIR, "attendance_*.xlsx")), key=os.path.getmtime)
+    for old_export in exports[:-EXPORT_KEEP]:
+        os.remove(old_export)
+    
+    return path, f"{total} records across {len(centres)} centres"
+
+def load_jobs(kind):
+    """Five most recent jobs of one kind"""
+    # Fragment reruns can land on another thread - don't reuse the script's connection
+    panel_conn = sqlite3.connect(DB_PATH)
+    jobs = panel_conn.execute("""
+        SELECT id, description, status, progress, result_path, message
+        FROM jobs WHERE kind = ?
+        ORDER BY id DESC LIMIT 5
+    """, (kind,)).fetchall()
+    panel_conn.close()
+    return jobs
+
+def read_artifact(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def job_status_panel(kind, key_prefix):
+    """Recent jobs of one kind. Polls itself every 2s (as a fragment) only while a job is active"""
+    jobs = load_jobs(kind)
+    if any(job[2] in ("queued", "running") for job in jobs):
+        st.fragment(render_job_list, run_every="2s")(kind, key_prefix, polling=True)
+    else:
+        render_job_list(kind, key_prefix, jobs)
+
+def render_job_list(kind, key_prefix, jobs=None, polling=False):
+    if jobs is None:
+        jobs = load_jobs(kind)
+    
+    # Last active job finished - one full rerun redraws the panel without polling
+    if polling and not any(job[2] in ("queued", "running") for job in jobs):
+        st.rerun()
+    
+    if not jobs:
+        return
+    
+    st.markdown("**⏳ Background Jobs**")
+    for job_id, description, status, progress, result_path, message in jobs:
+        if status in ("queued", "running"):
+            st.progress(progress or 0.0, text=f"#{job_id} {description} - {status}")
+        elif status == "done":
+            st.success(f"#{job_id} {description} - {message}")
+            if result_path and os.path.exists(result_path):
+                # File is only read when the button is clicked
+                st.download_button(
+                    "📥 Download",
+                    partial(read_artifact, result_path),
+                    os.path.basename(result_path),
+                    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key=f"{key_prefix}_dl_{job_id}"
+                )
+        else:
+            st.error(f"#{job_id} {description} - failed: {message}")
+
+def maintenance_job(job_conn, report_progress):
+    # No result_path - backups stay on the server (they contain coach PINs), never in the download panel
+    result = run_maintenance(job_conn, report_progress=report_progress)
+    return None, (f"Integrity {result['integrity']}, freed {result['freed_pages']} pages, purged {result['purged_students']} students, "
+                  f"backup {result['backup_path'] or 'skipped'}")
+
 def admin_dashboard():
     try:
         st.image("logo.jpg", width=100)
@@ -567,12 +721,19 @@ def admin_dashboard():
     
     st.markdown("---")
     
+    # Scheduled maintenance - queued in the background when the last run is too old
+    c = conn.cursor()
+    c.execute("SELECT EXISTS (SELECT 1 FROM jobs WHERE kind = 'maintenance' AND status IN ('queued', 'running'))")
+    if not c.fetchone()[0] and maintenance_due(c):
+        submit_job("maintenance", "Scheduled maintenance", maintenance_job)
+    
     # Tabs for different admin functions
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 Attendance Reports", "👥 Manage Students", "🏸 Manage Centres", "🔐 Manage Coaches"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8 = st.tabs(["📊 Attendance Reports", "👥 Manage Students", "🏸 Manage Centres", "🔐 Manage Coaches", "🎓 Student Profile", "📈 Slot Occupancy", "📱 WhatsApp Digest", "🧰 Maintenance"])
     
     with tab1:
         # Attendance Reports
         c = conn.cursor()
+        query_cache = get_query_cache()
         
         # Date range filter
         col1, col2 = st.columns(2)
@@ -582,8 +743,7 @@ def admin_dashboard():
             end_date = st.date_input("To Date", value=date.today())
         
         # Centre filter
-        c.execute("SELECT id, name FROM centres")
-        all_centres = c.fetchall()
+        all_centres = query_cache.fetchall(c, "SELECT id, name FROM centres")
         centre_filter = st.selectbox("Filter by Centre", ["All"] + [c[1] for c in all_centres])
         
         # Build query
@@ -603,8 +763,7 @@ def admin_dashboard():
         
         query += " ORDER BY a.date DESC, c.name, a.time_slot"
         
-        c.execute(query, params)
-        records = c.fetchall()
+        records = query_cache.fetchall(c, query, params)
         
         if records:
             df = pd.DataFrame(records, columns=["Date", "Centre", "Student", "Time Slot", "Status", "Coach"])
@@ -628,6 +787,56 @@ def admin_dashboard():
             st.download_button("📥 Download Report CSV", csv, "attendance_report.csv", "text/csv")
         else:
             st.info("No attendance records found for the selected period.")
+        
+        # Multi-month export runs in the background so the page stays responsive
+        st.markdown("---")
+        st.markdown("#### 📦 Excel Export (one sheet per centre)")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            export_start = st.date_input("From Date", value=date.today().replace(day=1) - timedelta(days=90), key="export_start")
+        with col2:
+            export_end = st.date_input("To Date", value=date.today(), key="export_end")
+        
+        if st.button("📦 Start Export"):
+            job_id = submit_job("export", f"Attendance {export_start.strftime('%d/%m/%Y')} - {export_end.strftime('%d/%m/%Y')}",
+                                export_attendance_job, export_start.isoformat(), export_end.isoformat())
+            st.success(f"Export #{job_id} started - you can keep working")
+        
+        job_status_panel("export", "export")
+        
+        cache_stats = query_cache.stats()
+        st.caption(f"Report cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+                   f"{cache_stats['entries']} entries at data version {cache_stats['version']}")
+        
+        # Monthly register - students down the side, dates across the top
+        st.markdown("---")
+        st.markdown("#### 📋 Monthly Register")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            register_centre = st.selectbox("Centre", [c[1] for c in all_centres], key="register_centre")
+        with col2:
+            today = date.today()
+            month_options = [
+                f"{(today.year * 12 + today.month - 1 - i) // 12}-{(today.year * 12 + today.month - 1 - i) % 12 + 1:02d}"
+                for i in range(12)
+            ]
+            register_month = st.selectbox("Month", month_options, key="register_month")
+        
+        register_centre_id = next(ac[0] for ac in all_centres if ac[1] == register_centre)
+        matrix = attendance_matrix(register_centre_id, register_month, get_data_version(c))
+        
+        if matrix.empty:
+            st.info("No attendance records for this centre and month.")
+        else:
+            st.dataframe(matrix, use_container_width=True)
+            st.download_button(
+                "📥 Download Register CSV",
+                matrix.to_csv(),
+                f"register_{register_centre.replace(' ', '_')}_{register_month}.csv",
+                "text/csv"
+            )
     
     with tab2:
         # Manage Students
@@ -658,25 +867,15 @@ def admin_dashboard():
                     st.write("Preview:", df_upload.head())
                     
                     if st.button("✅ Import Students from File"):
-                        centre_id = int(centre_for_upload.split(" - ")[0]) if " - " in centre_for_upload else 1
-                        imported = 0
-                        for _, row in df_upload.iterrows():
-                            try:
-                                name = str(row.iloc[0]).strip()
-                                phone = str(row.iloc[1]).strip() if len(row) > 1 else ""
-                                c.execute("""
-                                    INSERT INTO students (name, centre_id, phone, join_date)
-                                    VALUES (?, ?, ?, ?)
-                                """, (name, centre_id, phone, date.today().isoformat()))
-                                imported += 1
-                            except:
-                                pass
-                        conn.commit()
-                        st.success(f"Imported {imported} students!")
-                        st.rerun()
+                        centre_id = next(ac[0] for ac in all_centres if ac[1] == centre_for_upload)
+                        job_id = submit_job("import", f"{uploaded_file.name} ({len(df_upload)} rows) → {centre_for_upload}",
+                                            import_students_job, df_upload, centre_id)
+                        st.success(f"Import #{job_id} started - you can keep working")
                 except Exception as e:
                     st.error(f"Error reading file: {e}")
             
+            job_status_panel("import", "import")
+            
             st.markdown("---")
             st.markdown("**Or paste CSV data:**")
             csv_text = st.text_area("Paste names and mobile numbers", height=100, placeholder="Rahul Sharma, 9876543210\nAditi Patel, 9876543212")
@@ -684,7 +883,7 @@ def admin_dashboard():
             if st.button("📋 Import Pasted Data"):
                 if csv_text:
                     lines = csv_text.strip().split("\n")
-                    centre_id = int(centre_for_upload.split(" - ")[0]) if " - " in centre_for_upload else 1
+                    centre_id = next(ac[0] for ac in all_centres if ac[1] == centre_for_upload)
                     imported = 0
                     for line in lines:
                         parts = [p.strip() for p in line.split(",")]
@@ -714,7 +913,7 @@ def admin_dashboard():
             
             if st.button("➕ Add Student"):
                 if new_name:
-                    centre_id = int(new_centre.split(" - ")[0]) if " - " in new_centre else 1
+                    centre_id = next(ac[0] for ac in all_centres if ac[1] == new_centre)
                     try:
                         c.execute("""
                             INSERT INTO students (name, centre_id, phone, join_date)
@@ -731,13 +930,12 @@ def admin_dashboard():
         st.markdown("#### 📋 Current Students")
         
         # Get students first
-        c.execute("""
+        student_records = query_cache.fetchall(c, """
             SELECT s.id, s.name, c.name as centre, s.phone, s.join_date, s.is_active
             FROM students s
             JOIN centres c ON s.centre_id = c.id
             ORDER BY c.name, s.name
         """)
-        student_records = c.fetchall()
         
         # Delete all test data button
         col1, col2 = st.columns([3, 1])
@@ -747,7 +945,11 @@ def admin_dashboard():
             if st.button("🗑️ Delete All Test Data", type="secondary"):
                 c.execute("DELETE FROM students")
                 c.execute("DELETE FROM attendance")
+                c.execute("DELETE FROM student_monthly_stats")
+                c.execute("DELETE FROM student_stats")
+                c.execute("DELETE FROM expected_roster")
                 conn.commit()
+                conn.executescript("PRAGMA incremental_vacuum;")
                 st.success("All student and attendance data deleted!")
                 st.rerun()
         
@@ -837,6 +1039,148 @@ def admin_dashboard():
                     conn.commit()
                     st.success("Coach updated!")
                     st.rerun()
+    
+    with tab5:
+        # Student Profile - served from student_stats / student_monthly_stats
+        st.markdown("### 🎓 Student Profile")
+        
+        c.execute("""
+            SELECT s.id, s.name, c.name
+            FROM students s
+            JOIN centres c ON s.centre_id = c.id
+            WHERE s.is_active = 1
+            ORDER BY s.name
+        """)
+        profile_students = {f"{s[1]} - {s[2]} (#{s[0]})": s[0] for s in c.fetchall()}
+        
+        if not profile_students:
+            st.info("No active students yet.")
+        else:
+            selected_profile = st.selectbox("Select Student", list(profile_students), key="profile_student")
+            profile_id = profile_students[selected_profile]
+            
+            c.execute("SELECT last_attended, current_streak FROM student_stats WHERE student_id = ?", (profile_id,))
+            last_attended, current_streak = c.fetchone() or (None, 0)
+            
+            c.execute("""
+                SELECT month, time_slot, present, absent, leave
+                FROM student_monthly_stats
+                WHERE student_id = ?
+            """, (profile_id,))
+            df_stats = pd.DataFrame(c.fetchall(), columns=["Month", "Time Slot", "Present", "Absent", "Leave"])
+            
+            if df_stats.empty:
+                st.info("No attendance recorded for this student yet.")
+            else:
+                total = int(df_stats[["Present", "Absent", "Leave"]].sum().sum())
+                present = int(df_stats["Present"].sum())
+                
+                col1, col2, col3 = st.columns(3)
+                col1.metric("Last Attended", datetime.strptime(last_attended, "%Y-%m-%d").strftime("%d/%m/%Y") if last_attended else "Never")
+                col2.metric("Current Streak", f"{current_streak} sessions")
+                col3.metric("Attendance Rate", f"{present/total*100:.1f}%", f"{total} sessions", delta_color="off")
+                
+                # Monthly attendance rate
+                monthly = df_stats.groupby("Month")[["Present", "Absent", "Leave"]].sum()
+                monthly["Rate %"] = (monthly["Present"] / monthly.sum(axis=1) * 100).round(1)
+                st.markdown("#### 📅 Monthly Attendance")
+                st.bar_chart(monthly["Rate %"])
+                st.dataframe(monthly, use_container_width=True)
+                
+                # Slot distribution
+                st.markdown("#### ⏰ Slot Distribution")
+                slots = df_stats.groupby("Time Slot")[["Present", "Absent", "Leave"]].sum()
+                st.bar_chart(slots["Present"])
+                st.dataframe(slots, use_container_width=True)
+    
+    with tab6:
+        # Slot Occupancy - average present headcount per (centre, weekday, slot)
+        st.markdown("### 📈 Slot Occupancy")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            occ_start = st.date_input("From Date", value=date.today() - timedelta(weeks=8), key="occ_start")
+        with col2:
+            occ_end = st.date_input("To Date", value=date.today(), key="occ_end")
+        
+        df_occ = slot_occupancy(occ_start, occ_end, get_data_version(c))
+        
+        if df_occ.empty:
+            st.info("No attendance records found for the selected period.")
+        else:
+            st.caption("Average headcount counts only sessions where attendance was saved.")
+            
+            heat = (
+                df_occ.groupby(["Centre", "Weekday", "Time Slot"], observed=True)["Headcount"]
+                .agg(["mean", "count"])
+                .reset_index()
+                .rename(columns={"mean": "Avg Headcount", "count": "Sessions"})
+            )
+            heat["Avg Headcount"] = heat["Avg Headcount"].round(1)
+            heat["Centre / Slot"] = heat["Centre"] + " · " + heat["Time Slot"]
+            
+            chart = alt.Chart(heat).mark_rect().encode(
+                x=alt.X("Weekday:N", sort=list(df_occ["Weekday"].cat.categories)),
+                y=alt.Y("Centre / Slot:N", title=None),
+                color=alt.Color("Avg Headcount:Q", scale=alt.Scale(scheme="oranges")),
+                tooltip=["Centre", "Weekday", "Time Slot", "Avg Headcount", "Sessions"]
+            )
+            st.altair_chart(chart, use_container_width=True)
+            
+            # Weekly trend of average headcount per session, per centre
+            st.markdown("#### 📉 Weekly Trend")
+            trend = (
+                df_occ.groupby(["Centre", pd.Grouper(key="Date", freq="W-MON", label="left", closed="left")])["Headcount"]
+                .mean()
+                .unstack("Centre")
+                .round(1)
+            )
+            st.line_chart(trend)
+            
+            heat_table = heat.pivot_table(index=["Centre", "Time Slot"], columns="Weekday", values="Avg Headcount", observed=True)
+            heat_table.columns = heat_table.columns.astype(str)
+            st.dataframe(heat_table, use_container_width=True)
+    
+    with tab7:
+        # End-of-day digest for every centre in one message
+        st.markdown("### 📱 WhatsApp Digest")
+        
+        digest_date = st.date_input("Date", value=date.today(), key="digest_date")
+        digest = whatsapp_digest(digest_date.isoformat(), get_data_version(c))
+        
+        if digest:
+            st.code(digest, language=None)
+            st.markdown(f"<a href='{WHATSAPP_GROUP_LINK}' target='_blank'><button style='background-color:#25D366;color:white;padding:8px 16px;border:none;border-radius:5px;cursor:pointer;'>💬 Open WhatsApp Group</button></a>", unsafe_allow_html=True)
+        else:
+            st.info("No students marked present on this date.")
+        st.caption("Scheduled sends: `python manage.py digest --date YYYY-MM-DD`")
+    
+    with tab8:
+        # Database maintenance - also runs automatically once a day and via `python manage.py maintain`
+        st.markdown("### 🧰 Database Maintenance")
+        
+        size_bytes, free_pages = database_size(c)
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Database Size", f"{size_bytes / 1024 / 1024:.2f} MB")
+        col2.metric("Free Pages", free_pages)
+        col3.metric("Auto Vacuum", {0: "None", 1: "Full", 2: "Incremental"}[c.execute("PRAGMA auto_vacuum").fetchone()[0]])
+        
+        if st.button("▶️ Run Maintenance Now"):
+            job_id = submit_job("maintenance", "Manual maintenance", maintenance_job)
+            st.success(f"Maintenance #{job_id} started")
+        
+        job_status_panel("maintenance", "maint")
+        
+        c.execute("""
+            SELECT finished_at, integrity, purged_students, freed_pages, size_before, size_after, backup_path
+            FROM maintenance_log
+            ORDER BY id DESC LIMIT 10
+        """)
+        maintenance_runs = c.fetchall()
+        if maintenance_runs:
+            st.markdown("#### 📜 Recent Runs")
+            df_runs = pd.DataFrame(maintenance_runs, columns=["Finished", "Integrity", "Purged Students", "Freed Pages", "Size Before", "Size After", "Backup"])
+            st.dataframe(df_runs, use_container_width=True)
 
 def partner_dashboard():
     """Partners can see all centres but can't manage students/centres/coaches"""
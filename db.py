@@ -0,0 +1,509 @@
+"""
+Believers Badminton Academy - database layer
+Shared by the Streamlit app and the manage.py CLI, so nothing here may use Streamlit
+"""
+
+import sqlite3
+import os
+import glob
+from datetime import datetime, date, timedelta
+from jinja2 import Template
+
+# Database path - works locally and on Render
+DB_PATH = os.environ.get('DATABASE_PATH', 'believers_academy.db')
+
+# Online backups taken by run_maintenance(); only the newest BACKUP_KEEP are kept
+BACKUP_DIR = os.environ.get('BACKUP_DIR', 'backups')
+BACKUP_KEEP = 7
+MAINTENANCE_INTERVAL_HOURS = 24
+
+# A "regular" was present in at least half of a slot's sessions over this many weeks
+ROSTER_WEEKS = 8
+
+# PRAGMA user_version once the expected_roster backfill has run
+ROSTER_BACKFILLED = 1
+
+def init_db():
+    conn = sqlite3.connect(DB_PATH)
+    c = conn.cursor()
+    
+    # Only takes effect on a new (empty) file; run_maintenance() converts existing ones
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    
+    # Centres table
+    c.execute('''CREATE TABLE IF NOT EXISTS centres (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        address TEXT,
+        monday_friday_slots TEXT,
+        saturday_sunday_slots TEXT,
+        is_active INTEGER DEFAULT 1
+    )''')
+    
+    # Coaches table
+    c.execute('''CREATE TABLE IF NOT EXISTS coaches (
+        id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE NOT NULL,
+        pin TEXT NOT NULL,
+        role TEXT DEFAULT 'coach',
+        assigned_centre_id INTEGER,
+        FOREIGN KEY (assigned_centre_id) REFERENCES centres(id)
+    )''')
+    
+    # Students table
+    c.execute('''CREATE TABLE IF NOT EXISTS students (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        centre_id INTEGER,
+        phone TEXT,
+        parent_phone TEXT,
+        join_date TEXT,
+        is_active INTEGER DEFAULT 1,
+        FOREIGN KEY (centre_id) REFERENCES centres(id)
+    )''')
+    
+    # Attendance table
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance (
+        id INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        coach_id INTEGER,
+        student_id INTEGER,
+        centre_id INTEGER,
+        time_slot TEXT NOT NULL,
+        status TEXT DEFAULT 'Present',
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (coach_id) REFERENCES coaches(id),
+        FOREIGN KEY (student_id) REFERENCES students(id),
+        FOREIGN KEY (centre_id) REFERENCES centres(id)
+    )''')
+    
+    # Covering index for per-student history - profile lookups never touch the table
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attendance_student
+        ON attendance (student_id, date, status, time_slot)''')
+    
+    # Covering index for centre/month reports (register matrix)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_attendance_centre_date
+        ON attendance (centre_id, date, student_id, status)''')
+    
+    # One row per student/centre/date/slot - save_attendance() upserts against this, so it never
+    # depends on planner statistics. Older databases may hold duplicates: keep the newest entry
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_attendance_key'")
+    if c.fetchone() is None:
+        duplicates = "SELECT MAX(id) FROM attendance GROUP BY student_id, centre_id, date, time_slot"
+        c.execute(f"SELECT DISTINCT student_id FROM attendance WHERE id NOT IN ({duplicates})")
+        deduplicated_students = [row[0] for row in c.fetchall()]
+        c.execute(f"DELETE FROM attendance WHERE id NOT IN ({duplicates})")
+        c.execute('''CREATE UNIQUE INDEX idx_attendance_key
+            ON attendance (student_id, centre_id, date, time_slot)''')
+    else:
+        deduplicated_students = []
+
+    # Per-student aggregates (refreshed when that student's attendance is saved)
+    c.execute('''CREATE TABLE IF NOT EXISTS student_monthly_stats (
+        student_id INTEGER NOT NULL,
+        month TEXT NOT NULL,
+        time_slot TEXT NOT NULL,
+        present INTEGER DEFAULT 0,
+        absent INTEGER DEFAULT 0,
+        leave INTEGER DEFAULT 0,
+        PRIMARY KEY (student_id, month, time_slot)
+    ) WITHOUT ROWID''')
+    
+    c.execute('''CREATE TABLE IF NOT EXISTS student_stats (
+        student_id INTEGER PRIMARY KEY,
+        last_attended TEXT,
+        current_streak INTEGER DEFAULT 0,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # Background jobs (heavy imports/exports)
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        kind TEXT NOT NULL,
+        description TEXT,
+        status TEXT DEFAULT 'queued',
+        progress REAL DEFAULT 0,
+        result_path TEXT,
+        message TEXT,
+        created_by INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        finished_at TEXT,
+        FOREIGN KEY (created_by) REFERENCES coaches(id)
+    )''')
+    
+    # Maintenance runs (ANALYZE, vacuum, integrity check, backup)
+    c.execute('''CREATE TABLE IF NOT EXISTS maintenance_log (
+        id INTEGER PRIMARY KEY,
+        started_at TEXT,
+        finished_at TEXT,
+        integrity TEXT,
+        purged_students INTEGER DEFAULT 0,
+        freed_pages INTEGER DEFAULT 0,
+        size_before INTEGER,
+        size_after INTEGER,
+        backup_path TEXT
+    )''')
+    
+    # Data version - bumped by triggers on every write to report tables, used as a cache key
+    c.execute('''CREATE TABLE IF NOT EXISTS data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL DEFAULT 0
+    )''')
+    c.execute("INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)")
+    for table in ("attendance", "students", "centres", "coaches"):
+        for action in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f'''CREATE TRIGGER IF NOT EXISTS bump_version_{table}_{action.lower()}
+                AFTER {action} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END''')
+    
+    # Expected attendees per (centre, weekday, slot) - weekday is 0=Monday like date.weekday()
+    c.execute('''CREATE TABLE IF NOT EXISTS expected_roster (
+        centre_id INTEGER NOT NULL,
+        weekday INTEGER NOT NULL,
+        time_slot TEXT NOT NULL,
+        student_id INTEGER NOT NULL,
+        sessions INTEGER DEFAULT 0,
+        last_seen TEXT,
+        PRIMARY KEY (centre_id, weekday, time_slot, student_id)
+    ) WITHOUT ROWID''')
+    
+    # Backfill aggregates for databases created before the cache existed
+    c.execute("SELECT NOT EXISTS (SELECT 1 FROM student_stats) AND EXISTS (SELECT 1 FROM attendance)")
+    if c.fetchone()[0]:
+        c.execute("SELECT DISTINCT student_id FROM attendance")
+        refresh_student_stats(c, [row[0] for row in c.fetchall()])
+    elif deduplicated_students:
+        refresh_student_stats(c, deduplicated_students)
+
+    # Recorded in user_version rather than inferred from an empty table: with no attendance in the
+    # last ROSTER_WEEKS weeks the roster is legitimately empty and would be rebuilt on every rerun
+    if c.execute("PRAGMA user_version").fetchone()[0] < ROSTER_BACKFILLED:
+        refresh_expected_roster(c)
+        c.execute(f"PRAGMA user_version = {ROSTER_BACKFILLED}")
+    
+    conn.commit()
+    return conn
+
+def refresh_student_stats(c, student_ids, month=None):
+    """Recompute cached aggregates for the given students (only one YYYY-MM month if given)"""
+    for student_id in set(student_ids):
+        if month:
+            c.execute("DELETE FROM student_monthly_stats WHERE student_id = ? AND month = ?", (student_id, month))
+            date_filter = " AND date BETWEEN ? AND ?"
+            params = (student_id, f"{month}-01", f"{month}-31")
+        else:
+            c.execute("DELETE FROM student_monthly_stats WHERE student_id = ?", (student_id,))
+            date_filter = ""
+            params = (student_id,)
+        
+        c.execute(f"""
+            INSERT INTO student_monthly_stats (student_id, month, time_slot, present, absent, leave)
+            SELECT student_id, substr(date, 1, 7), time_slot,
+                   SUM(status = 'Present'), SUM(status = 'Absent'), SUM(status = 'Leave')
+            FROM attendance
+            WHERE student_id = ?{date_filter}
+            GROUP BY substr(date, 1, 7), time_slot
+        """, params)
+        
+        c.execute("SELECT MAX(date) FROM attendance WHERE student_id = ? AND status = 'Present'", (student_id,))
+        last_attended = c.fetchone()[0]
+        
+        # Streak = consecutive Present sessions, newest first; Leave doesn't break it
+        c.execute("SELECT status FROM attendance WHERE student_id = ? ORDER BY date DESC, id DESC", (student_id,))
+        streak = 0
+        for (status,) in c:
+            if status == "Absent":
+                break
+            if status == "Present":
+                streak += 1
+        
+        c.execute("""
+            INSERT OR REPLACE INTO student_stats (student_id, last_attended, current_streak, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        """, (student_id, last_attended, streak))
+
+def refresh_expected_roster(c, centre_id=None, weekday=None):
+    """Rebuild regulars from the last ROSTER_WEEKS weeks - for one centre/weekday, or everything"""
+    key_filter = ""
+    params = [(date.today() - timedelta(weeks=ROSTER_WEEKS)).isoformat()]
+    if centre_id is not None:
+        # Filter inside "recent" so only this centre's rows are read (idx_attendance_centre_date)
+        key_filter = " AND centre_id = ? AND (CAST(strftime('%w', date) AS INTEGER) + 6) % 7 = ?"
+        params += [centre_id, weekday]
+        c.execute("DELETE FROM expected_roster WHERE centre_id = ? AND weekday = ?", (centre_id, weekday))
+    else:
+        c.execute("DELETE FROM expected_roster")
+    
+    c.execute(f"""
+        WITH recent AS (
+            SELECT centre_id, (CAST(strftime('%w', date) AS INTEGER) + 6) % 7 AS weekday,
+                   time_slot, date, student_id, status
+            FROM attendance
+            WHERE date >= ?{key_filter}
+        ),
+        held AS (
+            SELECT centre_id, weekday, time_slot, COUNT(DISTINCT date) AS sessions
+            FROM recent
+            GROUP BY centre_id, weekday, time_slot
+        )
+        INSERT INTO expected_roster (centre_id, weekday, time_slot, student_id, sessions, last_seen)
+        SELECT r.centre_id, r.weekday, r.time_slot, r.student_id, COUNT(DISTINCT r.date), MAX(r.date)
+        FROM recent r
+        JOIN held h ON h.centre_id = r.centre_id AND h.weekday = r.weekday AND h.time_slot = r.time_slot
+        WHERE r.status = 'Present'
+        GROUP BY r.centre_id, r.weekday, r.time_slot, r.student_id
+        HAVING COUNT(DISTINCT r.date) * 2 >= MAX(h.sessions)
+    """, params)
+
+def database_size(c):
+    """(file size in bytes, free pages)"""
+    page_size = c.execute("PRAGMA page_size").fetchone()[0]
+    page_count = c.execute("PRAGMA page_count").fetchone()[0]
+    freelist = c.execute("PRAGMA freelist_count").fetchone()[0]
+    return page_size * page_count, freelist
+
+def maintenance_due(c):
+    """True if maintenance never ran or last ran more than MAINTENANCE_INTERVAL_HOURS ago"""
+    c.execute("SELECT MAX(finished_at) FROM maintenance_log")
+    last_run = c.fetchone()[0]
+    return last_run is None or datetime.fromisoformat(last_run) < datetime.now() - timedelta(hours=MAINTENANCE_INTERVAL_HOURS)
+
+def run_maintenance(conn, backup=True, report_progress=None):
+    """Compact, re-analyze, check and back up the database; returns the maintenance_log row as a dict.
+    Failed runs are logged too (integrity 'error: ...') so maintenance_due() backs off before retrying."""
+    report_progress = report_progress or (lambda fraction: None)
+    c = conn.cursor()
+    conn.commit()
+    result = {"started_at": datetime.now().isoformat(timespec="seconds"), "integrity": None, "purged_students": 0,
+              "freed_pages": 0, "size_before": None, "size_after": None, "backup_path": None}
+    
+    try:
+        result["size_before"], _ = database_size(c)
+        
+        # auto_vacuum=INCREMENTAL needs one full VACUUM to convert a file created without it
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            c.execute("VACUUM")
+        report_progress(0.2)
+        
+        # Soft-deleted students with no attendance history can go for good
+        c.execute("""
+            DELETE FROM students
+            WHERE is_active = 0 AND NOT EXISTS (SELECT 1 FROM attendance a WHERE a.student_id = students.id)
+        """)
+        result["purged_students"] = c.rowcount
+        conn.commit()
+        report_progress(0.3)
+        
+        # Planner statistics
+        c.execute("ANALYZE")
+        c.execute("PRAGMA optimize")
+        report_progress(0.5)
+        
+        # Give free pages (bulk deletes, purges) back to the filesystem.
+        # executescript steps the pragma to completion; execute() would free a single page
+        _, free_before = database_size(c)
+        conn.executescript("PRAGMA incremental_vacuum;")
+        result["size_after"], free_after = database_size(c)
+        result["freed_pages"] = free_before - free_after
+        report_progress(0.6)
+        
+        result["integrity"] = ", ".join(row[0] for row in c.execute("PRAGMA quick_check").fetchall())
+        report_progress(0.8)
+        
+        # Online backup - only of a database that passed the check
+        if backup and result["integrity"] == "ok":
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            path = os.path.join(BACKUP_DIR, f"believers_academy_{datetime.now():%Y%m%d_%H%M%S}.db")
+            target = sqlite3.connect(path)
+            conn.backup(target)
+            target.close()
+            result["backup_path"] = path
+            for old_backup in sorted(glob.glob(os.path.join(BACKUP_DIR, "believers_academy_*.db")))[:-BACKUP_KEEP]:
+                os.remove(old_backup)
+    except Exception as e:
+        conn.rollback()
+        result["integrity"] = f"error: {e}"
+        raise
+    finally:
+        result["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        c.execute("""
+            INSERT INTO maintenance_log (started_at, finished_at, integrity, purged_students, freed_pages, size_before, size_after, backup_path)
+            VALUES (:started_at, :finished_at, :integrity, :purged_students, :freed_pages, :size_before, :size_after, :backup_path)
+        """, result)
+        conn.commit()
+    return result
+
+def save_attendance(c, rows):
+    """Upsert (student_id, centre_id, date, time_slot, status, coach_id) rows and refresh the
+    aggregates they touch. Used by the app and by batch ingestion; the caller commits."""
+    # Last row wins for duplicate (student, centre, date, slot) keys
+    rows = list({(r[0], r[1], r[2], r[3]): r for r in rows}.values())
+    if not rows:
+        return
+    
+    c.executemany("""
+        INSERT INTO attendance (student_id, centre_id, date, time_slot, status, coach_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (student_id, centre_id, date, time_slot)
+        DO UPDATE SET status = excluded.status, coach_id = excluded.coach_id
+    """, rows)
+    
+    # Single-month saves (the usual case) only recompute that month
+    months = {r[2][:7] for r in rows}
+    refresh_student_stats(c, [r[0] for r in rows], months.pop() if len(months) == 1 else None)
+    for centre_id, weekday in {(r[1], date.fromisoformat(r[2]).weekday()) for r in rows}:
+        refresh_expected_roster(c, centre_id, weekday)
+
+def save_roster(c, rows):
+    """Upsert (name, centre_id, phone, join_date) students, matching active students by name within
+    the centre. A blank phone keeps the stored one. Returns (inserted, updated); the caller commits."""
+    c.execute("SELECT id, centre_id, lower(name) FROM students WHERE is_active = 1")
+    existing = {(centre_id, name): student_id for student_id, centre_id, name in c.fetchall()}
+    
+    inserts, updates = {}, []
+    for name, centre_id, phone, join_date in rows:
+        student_id = existing.get((centre_id, name.lower()))
+        if student_id is None:
+            inserts[(centre_id, name.lower())] = (name, centre_id, phone, join_date)
+        elif phone:
+            updates.append((phone, student_id))
+    
+    c.executemany("INSERT INTO students (name, centre_id, phone, join_date) VALUES (?, ?, ?, ?)", list(inserts.values()))
+    c.executemany("UPDATE students SET phone = ? WHERE id = ?", updates)
+    return len(inserts), len(updates)
+
+def get_data_version(c):
+    """Current data version - changes whenever attendance or students change"""
+    c.execute("SELECT version FROM data_version WHERE id = 1")
+    return c.fetchone()[0]
+
+def seed_data(conn):
+    """Seed initial data if tables are empty"""
+    c = conn.cursor()
+    
+    # Check if centres exist
+    c.execute("SELECT COUNT(*) FROM centres")
+    if c.fetchone()[0] == 0:
+        # Seed centres
+        centres = [
+            ("Dadar Railways", "Dadar Railway Station, Dadar East", "4 PM - 5 PM, 5 PM - 6 PM, 6 PM - 7 PM, 7 PM - 8 PM", "11 AM - 12 PM, 12 PM - 1 PM, 1 PM - 2 PM, 2 PM - 3 PM", 1),
+            ("Parsee Gymkhana", "Dadar West", "6 AM - 7 AM, 7 AM - 8 AM, 8 AM - 9 AM", "6 AM - 7 AM, 7 AM - 8 AM, 8 AM - 9 AM", 1),
+            ("Nirmal Park", "Nirmal Nagar, Byculla", "", "", 0),  # Dormant
+            ("Badhwar Park", "Colaba", "5 PM - 6 PM, 6 PM - 7 PM", "5 PM - 6 PM, 6 PM - 7 PM", 1),
+        ]
+        c.executemany("INSERT INTO centres (name, address, monday_friday_slots, saturday_sunday_slots, is_active) VALUES (?, ?, ?, ?, ?)", centres)
+        
+    # Check if coaches exist
+    c.execute("SELECT COUNT(*) FROM coaches")
+    if c.fetchone()[0] == 0:
+        # Seed coaches (PIN: 4 digits)
+        coaches = [
+            ("Prathamesh", "1234", "admin", None),  # Admin
+            ("Gautam", "5678", "coach", 2),          # Parsee Gymkhana
+            ("Madhur", "9012", "coach", 1),          # Dadar Railways
+            ("Sanket", "3456", "coach", 3),          # Nirmal Park (dormant)
+            ("Arif", "7890", "partner", None),       # Can see all
+            ("Manas", "2345", "partner", None),      # Can see all
+            ("Darshak", "6789", "partner", None),   # Can see all
+        ]
+        c.executemany("INSERT INTO coaches (name, pin, role, assigned_centre_id) VALUES (?, ?, ?, ?)", coaches)
+    
+    # Check if students exist
+    c.execute("SELECT COUNT(*) FROM students")
+    if c.fetchone()[0] == 0:
+        # Seed sample students (no parent phone - just name and mobile)
+        students = [
+            ("Aarav Sharma", 1, "9876543210", "2026-01-01"),
+            ("Vihaan Patel", 1, "9876543212", "2026-01-01"),
+            ("Arnav Singh", 1, "9876543214", "2026-01-05"),
+            ("Sai Kulkarni", 2, "9876543216", "2026-01-02"),
+            ("Reyansh Joshi", 2, "9876543218", "2026-01-03"),
+            ("Ayaan Desai", 2, "9876543220", "2026-01-04"),
+            ("Krishna Gawde", 4, "9876543222", "2026-01-06"),
+            ("OM Shinde", 4, "9876543224", "2026-01-07"),
+            ("Pranav Nair", 1, "9876543226", "2026-01-08"),
+            ("Kartik Iyer", 2, "9876543228", "2026-01-09"),
+        ]
+        c.executemany("INSERT INTO students (name, centre_id, phone, join_date) VALUES (?, ?, ?, ?)", students)
+    
+    conn.commit()
+
+def get_time_slots(c, centre_id, selected_date):
+    """Get time slots based on centre and day of week"""
+    c.execute("SELECT monday_friday_slots, saturday_sunday_slots FROM centres WHERE id = ?", (centre_id,))
+    row = c.fetchone()
+    
+    if not row:
+        return []
+    
+    day = selected_date.weekday()  # 0=Monday, 6=Sunday
+    slots_str = row[1] if day >= 5 else row[0]  # Sat/Sun or Mon-Fri
+    
+    if not slots_str:
+        return []
+    
+    return [s.strip() for s in slots_str.split(",")]
+
+# WhatsApp digest - one block per centre, same layout coaches already post
+DIGEST_TEMPLATE = Template("""\
+{% for centre in centres %}
+*{{ date_display }}*
+*{{ centre.name }}*
+*{{ day_name }}*
+
+{% for slot, names in centre.slots %}
+*{{ slot }}*
+{% for name in names %}
+{{ loop.index }}. {{ name }}
+{% endfor %}
+
+{% endfor %}
+{% endfor %}""", trim_blocks=True)
+
+def render_digest(c, date_str, centre_ids=None):
+    """Present students per centre and slot for one date, from a single query.
+    centre_ids limits the digest to those centres (always listed, even if nobody came)."""
+    params = [date_str, date_str]
+    centre_filter = ""
+    if centre_ids:
+        centre_filter = f" AND c.id IN ({', '.join('?' * len(centre_ids))})"
+        params += list(centre_ids)
+    
+    # Ordered by entry id so names come out in the order coaches added them
+    c.execute(f"""
+        SELECT c.id, c.name,
+               CASE WHEN strftime('%w', ?) IN ('0', '6') THEN c.saturday_sunday_slots ELSE c.monday_friday_slots END,
+               a.time_slot, s.name
+        FROM centres c
+        LEFT JOIN attendance a ON a.centre_id = c.id AND a.date = ? AND a.status = 'Present'
+        LEFT JOIN students s ON a.student_id = s.id
+        WHERE 1 = 1{centre_filter}
+        ORDER BY c.name, a.id
+    """, params)
+    rows = c.fetchall()
+    
+    selected_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    centres = {}
+    for centre_id, centre_name, slots_str, slot, student in rows:
+        if slot is None and not centre_ids:
+            continue
+        centre = centres.setdefault(centre_id, {"name": centre_name, "order": slots_str or "", "slots": {}})
+        if slot is not None:
+            centre["slots"].setdefault(slot, []).append(student)
+    
+    # Slots in the centre's configured order; anything no longer configured goes last
+    for centre in centres.values():
+        order = [s.strip() for s in centre["order"].split(",")]
+        centre["slots"] = sorted(
+            centre["slots"].items(),
+            key=lambda item: order.index(item[0]) if item[0] in order else len(order)
+        )
+    
+    return DIGEST_TEMPLATE.render(
+        centres=centres.values(),
+        date_display=selected_date.strftime("%d/%m/%Y"),
+        day_name=selected_date.strftime("%A")
+    )
@@ -0,0 +1,284 @@
+"""
+Believers Badminton Academy - command line tools
+Usage: python manage.py <command> [options]
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+from datetime import date, datetime
+
+from db import init_db, seed_data, render_digest, run_maintenance, save_attendance, save_roster
+
+STATUSES = {"present": "Present", "p": "Present", "absent": "Absent", "a": "Absent", "leave": "Leave", "l": "Leave"}
+MAX_ERRORS_SHOWN = 50
+
+
+def cmd_digest(conn, args):
+    """Print the WhatsApp digest for a date (e.g. from cron, piped to a sender)"""
+    c = conn.cursor()
+    centre_ids = None
+    if args.centre:
+        # Same matching as ingestion: id or name, any case
+        centres = load_centres(c)
+        try:
+            centre_ids = sorted({lookup(centres, name, "centre")[0] for name in args.centre})
+        except ValueError as e:
+            raise SystemExit(str(e).capitalize())
+    
+    digest = render_digest(c, args.date.isoformat(), centre_ids)
+    if not digest:
+        raise SystemExit(f"No students marked present on {args.date.strftime('%d/%m/%Y')}")
+    print(digest, end="")
+
+
+def cmd_maintain(conn, args):
+    """ANALYZE, incremental vacuum, quick_check and backup (e.g. nightly from cron)"""
+    try:
+        result = run_maintenance(conn, backup=not args.no_backup)
+    except Exception as e:
+        raise SystemExit(f"Maintenance failed: {e}")
+    print(f"Integrity:       {result['integrity']}")
+    print(f"Purged students: {result['purged_students']}")
+    print(f"Freed pages:     {result['freed_pages']}")
+    print(f"Size:            {result['size_before']} -> {result['size_after']} bytes")
+    print(f"Backup:          {result['backup_path'] or '-'}")
+    if result["integrity"] != "ok":
+        raise SystemExit(1)
+
+
+def read_records(path, fmt=None):
+    """Yield (line_number, record) from a CSV file with a header row, a JSON-lines file or a .json array
+    ('-' = stdin). Keys are lower-cased; record is None for an entry that isn't a JSON object.
+    For .json arrays the "line number" is the 1-based array position."""
+    fmt = fmt or ("jsonl" if path.endswith((".jsonl", ".ndjson")) else "json" if path.endswith(".json") else "csv")
+    try:
+        f = sys.stdin if path == "-" else open(path, newline="", encoding="utf-8-sig")
+    except OSError as e:
+        raise SystemExit(f"{path}: {e.strerror}")
+    try:
+        if fmt == "csv":
+            for line_number, record in enumerate(csv.DictReader(f), 2):
+                yield line_number, {k.strip().lower(): (v or "").strip() for k, v in record.items() if k}
+            return
+        
+        if fmt == "json":
+            try:
+                entries = json.load(f)
+            except ValueError:
+                entries = None
+            if not isinstance(entries, list):
+                raise SystemExit(f"{path}: expected a JSON array of objects")
+            numbered = enumerate(entries, 1)
+        else:
+            numbered = ((line_number, line) for line_number, line in enumerate(f, 1) if line.strip())
+        
+        for line_number, entry in numbered:
+            if fmt == "jsonl":
+                try:
+                    entry = json.loads(entry)
+                except ValueError:
+                    entry = None
+            if not isinstance(entry, dict):
+                yield line_number, None
+                continue
+            yield line_number, {k.lower(): str(v).strip() for k, v in entry.items() if v is not None}
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def parse_date(value):
+    """YYYY-MM-DD or DD/MM/YYYY (as shown in the app)"""
+    for fmt in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"bad date {value!r}")
+
+
+def date_arg(value):
+    """argparse type for dates - same formats as ingestion"""
+    try:
+        return parse_date(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def load_centres(c):
+    """Centre lookup by id or lower-cased name -> (id, Mon-Fri slots, Sat-Sun slots)"""
+    c.execute("SELECT id, name, monday_friday_slots, saturday_sunday_slots FROM centres")
+    centres = {}
+    for centre_id, name, mf_slots, ss_slots in c.fetchall():
+        entry = (
+            centre_id,
+            {s.strip() for s in (mf_slots or "").split(",") if s.strip()},
+            {s.strip() for s in (ss_slots or "").split(",") if s.strip()},
+        )
+        centres[str(centre_id)] = entry
+        centres[name.lower()] = entry
+    return centres
+
+
+def lookup(table, value, what):
+    if not value:
+        raise ValueError(f"missing {what}")
+    found = table.get(value.lower())
+    if found is None:
+        raise ValueError(f"unknown {what} {value!r}")
+    return found
+
+
+def write_batch(conn, args, errors, label, write):
+    """Report validation errors, then run write() in one transaction unless --strict rejects the batch"""
+    for error in errors[:MAX_ERRORS_SHOWN]:
+        print(error, file=sys.stderr)
+    if len(errors) > MAX_ERRORS_SHOWN:
+        print(f"... and {len(errors) - MAX_ERRORS_SHOWN} more", file=sys.stderr)
+    if errors and args.strict:
+        raise SystemExit(f"{len(errors)} invalid rows - nothing written (--strict)")
+    
+    started = time.perf_counter()
+    summary = write()
+    conn.commit()
+    # Refresh planner statistics if the batch changed the tables a lot (e.g. a first migration)
+    conn.execute("PRAGMA optimize")
+    elapsed = time.perf_counter() - started
+    print(f"{label}: {summary} in {elapsed:.2f}s, {len(errors)} rejected")
+    if errors:
+        raise SystemExit(1)
+
+
+def cmd_ingest_attendance(conn, args):
+    """Validate attendance rows against centres, slots and students, then upsert them in one transaction"""
+    c = conn.cursor()
+    centres = load_centres(c)
+    
+    c.execute("SELECT id, centre_id, name FROM students WHERE is_active = 1")
+    students_by_id, students_by_name = {}, {}
+    for student_id, centre_id, name in c.fetchall():
+        students_by_id[str(student_id)] = (student_id, centre_id)
+        key = (centre_id, name.lower())
+        # Two students with the same name at one centre can only be addressed by id
+        students_by_name[key] = None if key in students_by_name else student_id
+    
+    c.execute("SELECT id, name, role FROM coaches ORDER BY id")
+    coach_rows = c.fetchall()
+    coaches = {str(coach_id): coach_id for coach_id, _, _ in coach_rows}
+    coaches.update({name.lower(): coach_id for coach_id, name, _ in coach_rows})
+    try:
+        default_coach = lookup(coaches, args.coach, "coach") if args.coach else next(
+            (coach_id for coach_id, _, role in coach_rows if role == "admin"), None)
+    except ValueError as e:
+        raise SystemExit(f"--coach: {e}")
+    
+    rows, errors = [], []
+    for line_number, record in read_records(args.file, args.format):
+        try:
+            if record is None:
+                raise ValueError("not a JSON object")
+            
+            centre_id, mf_slots, ss_slots = lookup(centres, record.get("centre"), "centre")
+            day = parse_date(record.get("date", ""))
+            slot = record.get("time_slot") or record.get("slot", "")
+            if slot not in (ss_slots if day.weekday() >= 5 else mf_slots):
+                raise ValueError(f"slot {slot!r} is not configured for centre {record['centre']!r} on {day.strftime('%A')}")
+            
+            if record.get("student_id"):
+                student_id, student_centre = lookup(students_by_id, record["student_id"], "student_id")
+                if student_centre != centre_id:
+                    raise ValueError(f"student {student_id} is not at centre {record['centre']!r}")
+            else:
+                student = record.get("student") or record.get("name", "")
+                if not student:
+                    raise ValueError("missing student")
+                student_id = students_by_name.get((centre_id, student.lower()))
+                if student_id is None:
+                    raise ValueError(f"unknown or ambiguous student {student!r} at centre {record['centre']!r}")
+            
+            status = STATUSES.get((record.get("status") or "present").lower())
+            if status is None:
+                raise ValueError(f"bad status {record['status']!r}")
+            
+            coach_id = lookup(coaches, record["coach"], "coach") if record.get("coach") else default_coach
+            if coach_id is None:
+                raise ValueError("missing coach (add a coach column or pass --coach)")
+            
+            rows.append((student_id, centre_id, day.isoformat(), slot, status, coach_id))
+        except ValueError as e:
+            errors.append(f"line {line_number}: {e}")
+    
+    def write():
+        save_attendance(c, rows)
+        return f"{len(rows)} rows saved"
+    
+    write_batch(conn, args, errors, "attendance", write)
+
+
+def cmd_ingest_roster(conn, args):
+    """Validate students against centres, then insert new ones / update phones in one transaction"""
+    c = conn.cursor()
+    centres = load_centres(c)
+    today = date.today().isoformat()
+    
+    rows, errors = [], []
+    for line_number, record in read_records(args.file, args.format):
+        try:
+            if record is None:
+                raise ValueError("not a JSON object")
+            name = record.get("name", "")
+            if not name:
+                raise ValueError("missing name")
+            centre_id = lookup(centres, record.get("centre"), "centre")[0]
+            phone = record.get("phone") or record.get("mobile", "")
+            join_date = parse_date(record["join_date"]).isoformat() if record.get("join_date") else today
+            rows.append((name, centre_id, phone, join_date))
+        except ValueError as e:
+            errors.append(f"line {line_number}: {e}")
+    
+    def write():
+        inserted, updated = save_roster(c, rows)
+        return f"{inserted} added, {updated} updated"
+    
+    write_batch(conn, args, errors, "roster", write)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Believers Badminton Academy tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    digest = subparsers.add_parser("digest", help="Print the end-of-day WhatsApp digest")
+    digest.add_argument("--date", type=date_arg, default=date.today(), help="YYYY-MM-DD or DD/MM/YYYY (default: today)")
+    digest.add_argument("--centre", action="append", help="Limit to a centre by name or id (repeatable)")
+    digest.set_defaults(func=cmd_digest)
+    
+    maintain = subparsers.add_parser("maintain", help="Run database maintenance and take a backup")
+    maintain.add_argument("--no-backup", action="store_true", help="Skip the online backup")
+    maintain.set_defaults(func=cmd_maintain)
+    
+    for name, func, columns in [
+        ("ingest-attendance", cmd_ingest_attendance, "date, centre, time_slot, student or student_id, [status], [coach]"),
+        ("ingest-roster", cmd_ingest_roster, "name, centre, [phone], [join_date]"),
+    ]:
+        ingest = subparsers.add_parser(name, help=f"Bulk load from CSV/JSON lines ({columns})")
+        ingest.add_argument("file", help="CSV with header row, .jsonl or .json array file; '-' reads stdin")
+        ingest.add_argument("--format", choices=["csv", "jsonl", "json"], help="Override format detection (json = one array)")
+        ingest.add_argument("--strict", action="store_true", help="Write nothing if any row is invalid")
+        if name == "ingest-attendance":
+            ingest.add_argument("--coach", help="Coach for rows without a coach column (default: first admin)")
+        ingest.set_defaults(func=func)
+    
+    args = parser.parse_args()
+    conn = init_db()
+    seed_data(conn)
+    try:
+        args.func(conn, args)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()